@@ -4,7 +4,75 @@ HTTP Header Parser for HTTPProxy.
 This module contains the HTTPHeader class for parsing, manipulating, and generating HTTP headers.
 """
 
-from typing import Dict, Optional, Tuple
+import sys
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import (Callable, Dict, Iterable, Iterator, List, Mapping,
+                    Optional, Tuple, Union)
+
+# Header names that show up on nearly every message. Parsed names are swapped
+# for these shared, interned instances, so the per-message copy is dropped
+# straight away and later lookups with the same literal compare by identity.
+# Each maps to (name, lowercase name) so the case-insensitive index needs no
+# str.lower() call for them either.
+_COMMON_HEADERS = {name: (sys.intern(name), sys.intern(name.lower())) for name in (
+    'Accept', 'Accept-Encoding', 'Accept-Language', 'Accept-Ranges',
+    'Age', 'Authorization', 'Cache-Control', 'Connection',
+    'Content-Encoding', 'Content-Length', 'Content-Type', 'Cookie',
+    'Date', 'ETag', 'Expires', 'Host', 'If-Modified-Since',
+    'If-None-Match', 'Keep-Alive', 'Last-Modified', 'Location', 'Origin',
+    'Pragma', 'Proxy-Connection', 'Referer', 'Server', 'Set-Cookie',
+    'Transfer-Encoding', 'Upgrade', 'User-Agent', 'Vary',
+)}
+
+
+# Status codes are always three ASCII digits. Looking the token up here both
+# converts and validates it, without int()'s sign, underscore and Unicode
+# digit handling or a try/except on bad input.
+_STATUS_CODES = {str(code): code for code in range(100, 1000)}
+
+# Most released HTTPHeader instances kept for reuse
+POOL_SIZE = 64
+
+# Bits in HTTPHeader._parsed for the lazily parsed parts of a message, and
+# for whether its header fields or body have been changed since
+_PARSED_HEADERS = 1
+_PARSED_BODY = 2
+_MODIFIED = 4
+
+# Request-line parser generated by HTTPHeader.install_method_table(), or None
+# to always use the generic split
+_fast_request_line: Optional[Callable[[str], Optional[Tuple[str, str, str]]]] = None
+
+
+# Methods and versions come from a small fixed set. Parsed tokens are swapped
+# for these interned instances so later comparisons hit the identity fast
+# path in str.__eq__ instead of comparing characters.
+_METHODS = {method: sys.intern(method) for method in (
+    'GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE',
+    'PATCH',
+)}
+_VERSIONS = {version: sys.intern(version) for version in (
+    'HTTP/1.0', 'HTTP/1.1', 'HTTP/2.0',
+)}
+
+
+class HTTPMethod:
+    """
+    Interned HTTP method names.
+    
+    A method parsed by HTTPHeader is the same object as the matching
+    constant here, so callers can branch with ``is``.
+    """
+    GET = _METHODS['GET']
+    HEAD = _METHODS['HEAD']
+    POST = _METHODS['POST']
+    PUT = _METHODS['PUT']
+    DELETE = _METHODS['DELETE']
+    CONNECT = _METHODS['CONNECT']
+    OPTIONS = _METHODS['OPTIONS']
+    TRACE = _METHODS['TRACE']
+    PATCH = _METHODS['PATCH']
 
 
 class HTTPHeader:
@@ -17,107 +85,162 @@ class HTTPHeader:
         version: HTTP version (e.g., "HTTP/1.0")
         status_code: HTTP status code - for responses
         status_message: HTTP status message - for responses
-        headers: Dictionary of header fields
+        headers: Dictionary of header fields, keyed by the name as it was
+            first seen; use the accessors for case-insensitive lookups
         body: Optional message body
     """
     
-    def __init__(self, header_string: str):
+    # A proxy keeps one of these per in-flight message; fixed slots drop the
+    # per-instance __dict__ and make attribute access a direct slot load
+    __slots__ = ('method', 'path', 'version', 'status_code', 'status_message',
+                 'is_request', '_headers', '_names', '_body', '_raw',
+                 '_fields', '_crlf', '_body_start', '_parsed', '_first')
+    
+    # Released instances waiting to be reused by acquire(). list.pop() and
+    # list.append() are atomic under the GIL, so worker threads can share it.
+    _pool: List['HTTPHeader'] = []
+    
+    def __init__(self, header_string: Union[str, bytes]):
         """
         Initialize HTTPHeader by parsing a raw HTTP header string.
         
         Args:
-            header_string: Raw HTTP header string to parse
+            header_string: Raw HTTP header string to parse, either text or
+                the bytes exactly as read from a socket
+        """
+        self._reset()
+        self._parse(header_string)
+    
+    @classmethod
+    def acquire(cls, header_string: Union[str, bytes]) -> 'HTTPHeader':
+        """
+        Get a parsed HTTPHeader, reusing a released instance if one is free.
+        
+        Args:
+            header_string: Raw HTTP header string or bytes to parse
+        
+        Returns:
+            HTTPHeader for header_string; hand it back with release()
+        """
+        try:
+            header = cls._pool.pop()
+        except IndexError:
+            return cls(header_string)
+        header._reset()
+        header._parse(header_string)
+        return header
+    
+    def release(self) -> None:
+        """Return this header to the pool. It must not be used afterwards."""
+        pool = type(self)._pool
+        if len(pool) < POOL_SIZE:
+            pool.append(self)
+    
+    @classmethod
+    @contextmanager
+    def scoped(cls, header_string: Union[str, bytes]) -> Iterator['HTTPHeader']:
+        """
+        Context manager that acquires a header and releases it on exit.
+        
+        Args:
+            header_string: Raw HTTP header string or bytes to parse
         """
+        header = cls.acquire(header_string)
+        try:
+            yield header
+        finally:
+            header.release()
+    
+    def _reset(self) -> None:
+        """Put every field back to the state of an empty message."""
         self.method: Optional[str] = None
         self.path: Optional[str] = None
         self.version: str = "HTTP/1.0"
         self.status_code: Optional[int] = None
         self.status_message: Optional[str] = None
-        self.headers: Dict[str, str] = {}
-        self.body: Optional[str] = None
         self.is_request: bool = True
         
-        self._parse(header_string)
+        # Header fields and body are parsed on first access. Until then only
+        # the raw message, its header field block and the body offset are
+        # kept, and _parsed records which parts have been materialized. The
+        # dicts are only created by that first parse, so a message never
+        # allocates a pair of empty ones just to throw them away.
+        self._headers: Optional[Dict[str, str]] = None
+        self._names: Optional[Dict[str, str]] = None  # Lowercased name -> key
+        self._body: Optional[str] = None
+        self._raw: str = ""
+        self._fields: str = ""
+        self._crlf: bool = True
+        self._body_start: int = -1
+        self._parsed: int = 0
+        
+        # First-line fields as parsed. While they still match and no header
+        # or body has been touched, generate_header can return the raw
+        # message instead of rebuilding it.
+        self._first: Optional[tuple] = None
     
-    def _parse(self, header_string: str) -> None:
+    def _parse(self, header_string: Union[str, bytes]) -> None:
         """
         Parse the HTTP header string and populate object attributes.
-        Supports CRLF (\\r\\n), LF (\\n), and CR (\\r) line endings.
+        Supports CRLF (\\r\\n) and LF (\\n) line endings, mixed freely. A lone
+        CR (\\r) is not a line ending.
         
         Args:
-            header_string: Raw HTTP header string
+            header_string: Raw HTTP header string or bytes
         """
         if not header_string:
             return
         
-        # Normalize line endings: replace CRLF and CR with LF, then split
-        normalized = header_string.replace('\r\n', '\n').replace('\r', '\n')
-        lines = normalized.split('\n')
-        
-        if not lines:
-            return
-        
-        # Parse the first line (request line or status line)
-        first_line = lines[0].strip()
-        if first_line.startswith('HTTP/'):
-            # Response: HTTP/1.0 200 OK
-            self._parse_status_line(first_line)
-            self.is_request = False
-        else:
-            # Request: GET /path HTTP/1.0
-            self._parse_request_line(first_line)
-            self.is_request = True
-        
-        # Parse headers
-        i = 1
-        while i < len(lines):
-            line = lines[i].strip()
-            if not line:
-                # Empty line indicates end of headers
-                # Everything after is the body
-                if i + 1 < len(lines):
-                    self.body = '\n'.join(lines[i + 1:])
-                break
-            
-            # Parse header field
-            if ':' in line:
-                key, value = line.split(':', 1)
-                self.headers[key.strip()] = value.strip()
-            
-            i += 1
-    
-    def _parse_request_line(self, line: str) -> None:
-        """
-        Parse HTTP request line (e.g., "GET /index.html HTTP/1.0").
+        # Latin-1 maps every byte to one code point with no validation, so
+        # raw socket data becomes text in a single memcpy-like pass
+        if isinstance(header_string, (bytes, bytearray)):
+            header_string = header_string.decode('latin-1')
         
-        Args:
-            line: Request line string
-        """
-        parts = line.split()
-        if len(parts) >= 1:
-            self.method = parts[0]
-        if len(parts) >= 2:
-            self.path = parts[1]
-        if len(parts) >= 3:
-            self.version = parts[2]
+        (self.is_request, self.method, self.path, self.version,
+         self.status_code, self.status_message, self._fields, self._crlf,
+         self._body_start) = _parse_message(header_string)
+        self._raw = header_string
+        self._first = (self.is_request, self.method, self.path, self.version,
+                       self.status_code, self.status_message)
+    
+    def _get_headers(self) -> Dict[str, str]:
+        """Return the header dict, parsing the raw field block if needed."""
+        if not self._parsed & _PARSED_HEADERS:
+            self._headers, self._names = _parse_fields(self._fields, self._crlf)
+            self._fields = ""
+            self._parsed |= _PARSED_HEADERS
+        return self._headers
     
-    def _parse_status_line(self, line: str) -> None:
+    @property
+    def headers(self) -> Dict[str, str]:
         """
-        Parse HTTP status line (e.g., "HTTP/1.0 200 OK").
+        Header fields, parsed from the raw message on first access.
         
-        Args:
-            line: Status line string
-        """
-        parts = line.split(None, 2)
-        if len(parts) >= 1:
-            self.version = parts[0]
-        if len(parts) >= 2:
-            try:
-                self.status_code = int(parts[1])
-            except ValueError:
-                self.status_code = None
-        if len(parts) >= 3:
-            self.status_message = parts[2]
+        The dict may be changed in place by the caller, so handing it out
+        counts as a modification for generate_header.
+        """
+        self._parsed |= _MODIFIED
+        return self._get_headers()
+    
+    @headers.setter
+    def headers(self, headers: Dict[str, str]) -> None:
+        self._headers = headers
+        self._names = {key.lower(): key for key in headers}
+        self._parsed |= _PARSED_HEADERS | _MODIFIED
+    
+    @property
+    def body(self) -> Optional[str]:
+        """Message body, sliced from the raw message on first access."""
+        if not self._parsed & _PARSED_BODY:
+            if self._body_start >= 0:
+                self._body = self._raw[self._body_start:] or None
+            self._parsed |= _PARSED_BODY
+        return self._body
+    
+    @body.setter
+    def body(self, body: Optional[str]) -> None:
+        self._body = body
+        self._parsed |= _PARSED_BODY | _MODIFIED
     
     # Getters
     def get_method(self) -> Optional[str]:
@@ -142,7 +265,7 @@ class HTTPHeader:
     
     def get_header(self, key: str) -> Optional[str]:
         """
-        Get a specific header value.
+        Get a specific header value. Names are matched case-insensitively.
         
         Args:
             key: Header field name
@@ -150,11 +273,24 @@ class HTTPHeader:
         Returns:
             Header value or None if not found
         """
-        return self.headers.get(key)
+        # Callers almost always use the spelling the peer sent, so try that
+        # before paying for str.lower()
+        headers = self._get_headers()
+        value = headers.get(key)
+        if value is None:
+            name = self._names.get(key.lower())
+            if name is not None:
+                value = headers[name]
+        return value
     
-    def get_all_headers(self) -> Dict[str, str]:
-        """Get all headers as a dictionary."""
-        return self.headers.copy()
+    def get_all_headers(self) -> Mapping[str, str]:
+        """
+        Get all headers as a read-only mapping.
+        
+        This is a live view rather than a copy, so it reflects later changes;
+        use dict() on it for an independent, mutable snapshot.
+        """
+        return MappingProxyType(self._get_headers())
     
     def get_body(self) -> Optional[str]:
         """Get the message body."""
@@ -185,13 +321,20 @@ class HTTPHeader:
     
     def set_header(self, key: str, value: str) -> None:
         """
-        Set or update a header field.
+        Set or update a header field. An existing field with the same name
+        in any case is updated in place and keeps its spelling.
         
         Args:
             key: Header field name
             value: Header field value
         """
-        self.headers[key] = value
+        headers = self._get_headers()
+        name = self._names.setdefault(key.lower(), key)
+        # Writing back the value a field already has leaves the message
+        # unmodified, so it can still be forwarded as received
+        if headers.get(name) != value:
+            headers[name] = value
+            self._parsed |= _MODIFIED
     
     def add_header(self, key: str, value: str) -> None:
         """
@@ -205,13 +348,16 @@ class HTTPHeader:
     
     def remove_header(self, key: str) -> None:
         """
-        Remove a header field.
+        Remove a header field. Names are matched case-insensitively.
         
         Args:
             key: Header field name to remove
         """
-        if key in self.headers:
-            del self.headers[key]
+        headers = self._get_headers()
+        name = self._names.pop(key.lower(), None)
+        if name is not None:
+            del headers[name]
+            self._parsed |= _MODIFIED
     
     def set_body(self, body: str) -> None:
         """Set the message body."""
@@ -224,32 +370,164 @@ class HTTPHeader:
         Returns:
             Formatted HTTP header string
         """
-        lines = []
+        # A message that comes out exactly as it went in is the common case
+        # for a proxy; skip the rebuild entirely when nothing has changed
+        raw = self._unmodified_raw()
+        if raw is not None:
+            return raw
+        
+        # Every piece goes into one flat list and is joined exactly once,
+        # so no per-line strings are built and the result is never copied
+        # again to append the final line ending
+        parts = self._head_parts()
+        
+        # Add body if present
+        if self.body:
+            parts += (self.body, '\r\n')
+        
+        return ''.join(parts)
+    
+    def _head_parts(self) -> List[str]:
+        """
+        Build the first line, header fields and blank line as string pieces.
         
-        # Generate first line
+        Returns:
+            List of pieces that join into the header block
+        """
         if self.is_request:
             # Request line: METHOD PATH VERSION
-            method = self.method or "GET"
-            path = self.path or "/"
-            lines.append(f"{method} {path} {self.version}")
+            parts = [self.method or "GET", ' ', self.path or "/", ' ',
+                     self.version, '\r\n']
         else:
             # Status line: VERSION STATUS_CODE STATUS_MESSAGE
-            code = self.status_code or 200
-            message = self.status_message or "OK"
-            lines.append(f"{self.version} {code} {message}")
+            parts = [self.version, ' ', str(self.status_code or 200), ' ',
+                     self.status_message or "OK", '\r\n']
         
         # Add headers
-        for key, value in self.headers.items():
-            lines.append(f"{key}: {value}")
+        for key, value in self._get_headers().items():
+            parts += (key, ': ', value, '\r\n')
         
         # Add empty line to separate headers from body
-        lines.append("")
+        parts.append('\r\n')
+        return parts
+    
+    def _unmodified_raw(self) -> Optional[str]:
+        """
+        Return the raw message in generate_header form if it is unchanged.
         
-        # Add body if present
+        Only CRLF messages qualify, since LF input has to be rewritten. The
+        blank line is added when the raw header block stopped short of it,
+        and a body is followed by CRLF the same way a rebuilt one is.
+        
+        Returns:
+            The message to send, or None if it has to be rebuilt
+        """
+        raw = self._raw
+        if (not raw or not self._crlf or self._parsed & _MODIFIED
+                or self._first != (self.is_request, self.method, self.path,
+                                   self.version, self.status_code,
+                                   self.status_message)):
+            return None
+        if self._body_start < 0:
+            return raw + ('\r\n' if raw.endswith('\r\n') else '\r\n\r\n')
+        if self._body_start < len(raw):
+            return raw + '\r\n'
+        return raw
+    
+    def generate_bytes(self) -> bytes:
+        """
+        Generate the HTTP header ready to be written to a socket.
+        
+        Headers are Latin-1 on the wire, which also round-trips any bytes
+        that were passed to the constructor unchanged.
+        
+        Returns:
+            Formatted HTTP header as bytes
+        """
+        return self.generate_header().encode('latin-1')
+    
+    def iovecs(self) -> List[bytes]:
+        """
+        Generate the message as separate byte segments for a gathered write.
+        
+        The header block and the body stay in their own segments, so a body
+        is never copied into one buffer with the headers. The segments join
+        into exactly what generate_bytes() returns.
+        
+        Returns:
+            List of non-empty bytes segments, ready for socket.sendmsg()
+        """
+        raw = self._unmodified_raw()
+        if raw is not None:
+            start = self._body_start
+            if start < 0 or start == len(self._raw):
+                return [raw.encode('latin-1')]
+            # Unchanged message with a body: split the raw text at the body
+            return [self._raw[:start].encode('latin-1'),
+                    self._raw[start:].encode('latin-1'), b'\r\n']
+        
+        segments = [''.join(self._head_parts()).encode('latin-1')]
         if self.body:
-            lines.append(self.body)
+            segments += (self.body.encode('latin-1'), b'\r\n')
+        return segments
+    
+    @classmethod
+    def install_method_table(cls, methods: Iterable[str]) -> None:
+        """
+        Generate and install a request-line parser specialized for methods.
+        
+        The generated code tests each method prefix with a constant slice
+        compare and cuts path and version with one find(), instead of the
+        generic whitespace split. Lines it does not recognize (other
+        methods, unknown versions, anything but two single spaces between
+        the fields) fall back to the generic parser, so results never
+        change. A path that is not printable falls back too, which catches
+        every whitespace character split() would cut on other than the
+        space itself. Pass an empty iterable to remove the specialized
+        parser.
+        
+        Args:
+            methods: Methods to specialize for, most frequent first
+        
+        Raises:
+            ValueError: If a method is not a plain alphabetic token
+        """
+        global _fast_request_line
         
-        return '\r\n'.join(lines) + '\r\n' # check??
+        methods = list(methods)
+        if not methods:
+            _fast_request_line = None
+            return
+        
+        lines = ["def _fast_request_line(line):"]
+        for i, method in enumerate(methods):
+            if not (method.isascii() and method.isalpha()):
+                raise ValueError(f"Invalid HTTP method: {method!r}")
+            prefix = method + ' '
+            keyword = "if" if i == 0 else "elif"
+            lines += [
+                f"    {keyword} line[:{len(prefix)}] == {prefix!r}:",
+                f"        method = {method!r}",
+                f"        start = {len(prefix)}",
+            ]
+        lines += [
+            "    else:",
+            "        return None",
+            "    space = line.find(' ', start)",
+            "    if space <= start:",
+            "        return None",
+            "    version = _VERSIONS.get(line[space + 1:])",
+            "    if version is None:",
+            "        return None",
+            "    path = line[start:space]",
+            "    if not path.isprintable():",
+            "        return None",
+            "    return _METHODS.get(method, method), path, version",
+        ]
+        namespace = {'_METHODS': _METHODS, '_VERSIONS': _VERSIONS}
+        exec(compile('\n'.join(lines), '<http_parser method table>', 'exec'),
+             namespace)
+        _fast_request_line = namespace['_fast_request_line']
     
     def to_output(self) -> str:
 
@@ -279,4 +557,149 @@ class HTTPHeader:
         if self.is_request:
             return f"HTTPHeader(method={self.method}, path={self.path}, version={self.version})"
         else:
-            return f"HTTPHeader(status={self.status_code}, message={self.status_message}, version={self.version})"
\ No newline at end of file
+            return f"HTTPHeader(status={self.status_code}, message={self.status_message}, version={self.version})"
+
+
+def _parse_message(text: str) -> Tuple[bool, Optional[str], Optional[str], str,
+                                       Optional[int], Optional[str], str, bool,
+                                       int]:
+    """
+    Parse the first line of a raw HTTP message and locate its other parts.
+    
+    The header fields and body are only located, not parsed, so callers
+    that route on the method, path or status never pay for them. Everything
+    happens on locals and comes back as a single tuple, so the hot path
+    never stores to instance attributes or calls back into methods.
+    
+    Args:
+        text: Raw HTTP message string
+    
+    Returns:
+        Tuple of (is_request, method, path, version, status_code,
+        status_message, fields, crlf, body_start) where fields is the raw
+        header field block after the first line, crlf tells whether that
+        block only uses CRLF line endings, and body_start is the offset of
+        the body in text or -1 if there is none
+    """
+    method = path = status_code = status_message = None
+    version = "HTTP/1.0"
+    body_start = -1
+    
+    # Fast path for plain CRLF messages: str.find and str.count on a one or
+    # two character needle run CPython's vectorized fastsearch. The count
+    # proves the block holds no bare LF, which is the only way an earlier
+    # end-of-headers marker could hide before the first CRLFCRLF.
+    end = text.find('\r\n\r\n')
+    block = text if end < 0 else text[:end]
+    crlf = block.count('\n') == block.count('\r\n')
+    if crlf:
+        if end >= 0:
+            body_start = end + 4
+        eol = block.find('\r\n')
+        if eol < 0:
+            first_line, fields = block, ''
+        else:
+            first_line, fields = block[:eol], block[eol + 2:]
+    else:
+        # LF or mixed line endings: every line ends in LF, so the headers end
+        # at the first LF followed by an optional CR and another LF. A CR
+        # left at the end of a header line is stripped with its value; the
+        # first line drops its own below.
+        end = text.find('\n\n')
+        sep_end = end + 2
+        mixed = text.find('\n\r\n')
+        if mixed >= 0 and (end < 0 or mixed < end):
+            end, sep_end = mixed, mixed + 3
+        if end >= 0:
+            block = text[:end]
+            body_start = sep_end
+        else:
+            block = text
+        eol = block.find('\n')
+        if eol < 0:
+            first_line, fields = block, ''
+        else:
+            first_line, fields = block[:eol].rstrip('\r'), block[eol + 1:]
+    
+    # Parse the first line (request line or status line). A single split
+    # both tokenizes the line and tells the two kinds apart, with no
+    # separate strip() or startswith() pass over the whole line.
+    request = None
+    if _fast_request_line is not None:
+        request = _fast_request_line(first_line)
+    if request is not None:
+        # Request line recognized by the installed method table
+        is_request = True
+        method, path, version = request
+    else:
+        parts = first_line.split(None, 2)
+        is_request = not (parts and parts[0].startswith('HTTP/'))
+        if is_request:
+            # Request: GET /path HTTP/1.0
+            if len(parts) >= 1:
+                method = _METHODS.get(parts[0], parts[0])
+            if len(parts) >= 2:
+                path = parts[1]
+            if len(parts) >= 3:
+                # Anything after the version token (trailing whitespace or
+                # stray words) is dropped, as a plain split() would
+                version = _VERSIONS.get(parts[2])
+                if version is None:
+                    version = parts[2].split(None, 1)[0]
+                    version = _VERSIONS.get(version, version)
+        else:
+            # Response: HTTP/1.0 200 OK
+            version = _VERSIONS.get(parts[0], parts[0])
+            if len(parts) >= 2:
+                status_code = _STATUS_CODES.get(parts[1])
+            if len(parts) >= 3:
+                status_message = parts[2].rstrip()
+    
+    return (is_request, method, path, version, status_code, status_message,
+            fields, crlf, body_start)
+
+
+def _parse_fields(fields: str, crlf: bool) -> Tuple[Dict[str, str],
+                                                    Dict[str, str]]:
+    """
+    Parse a raw header field block.
+    
+    Args:
+        fields: Header lines that follow the first line, without the
+            blank line that ends them
+        crlf: True if the block only uses CRLF line endings, otherwise
+            lines end in LF with an optional CR
+    
+    Returns:
+        Tuple of (headers, names) where names maps each lowercased header
+        name to its key in headers
+    """
+    headers: Dict[str, str] = {}
+    names: Dict[str, str] = {}
+    if not fields:
+        return headers, names
+    
+    # Split on the line ending in one pass. On the LF path a trailing CR
+    # stays on the line and is stripped along with the value.
+    lines = fields.split('\r\n') if crlf else fields.split('\n')
+    
+    common = _COMMON_HEADERS
+    for line in lines:
+        # Lines carry no line endings here and the key and value are
+        # stripped on their own below, so the whole line is never stripped.
+        # partition() finds the colon and cuts both halves in a single C
+        # call; strip() hands back the same object when a key is already
+        # clean, so well-formed names cost no extra allocation.
+        key, colon, value = line.partition(':')
+        if colon:
+            key = key.strip()
+            interned = common.get(key)
+            if interned is None:
+                lower = key.lower()
+            else:
+                key, lower = interned
+            # A repeated field keeps the spelling it was first seen with
+            key = names.setdefault(lower, key)
+            headers[key] = value.strip()
+    
+    return headers, names
@@ -5,7 +5,7 @@ Tests parsing, manipulation, and generation of HTTP headers with various line en
 """
 
 import unittest
-from http_parser import HTTPHeader
+from http_parser import HTTPHeader, HTTPMethod
 
 
 class TestHTTPHeaderParsing(unittest.TestCase):
@@ -65,6 +65,14 @@ class TestHTTPHeaderParsing(unittest.TestCase):
         self.assertEqual(header.get_status_code(), 404)
         self.assertEqual(header.get_status_message(), "Not Found")
     
+    def test_parse_response_with_invalid_status_code(self):
+        """Test that a status code that is not three digits is rejected."""
+        for code in ("abc", "20", "2000", "+200"):
+            header = HTTPHeader(f"HTTP/1.1 {code} OK\r\n\r\n")
+            
+            self.assertIsNone(header.get_status_code())
+            self.assertFalse(header.is_request)
+    
     def test_parse_with_body(self):
         """Test parsing HTTP message with body."""
         header_str = (
@@ -79,6 +87,53 @@ class TestHTTPHeaderParsing(unittest.TestCase):
         self.assertEqual(header.get_body(), "Hello, World!")
         self.assertEqual(header.get_method(), "POST")
     
+    def test_parse_body_keeps_line_endings(self):
+        """Test that the body is taken verbatim from the message."""
+        header_str = "POST /submit HTTP/1.1\r\nContent-Length: 12\r\n\r\nline1\r\nline2"
+        header = HTTPHeader(header_str)
+        
+        self.assertEqual(header.get_body(), "line1\r\nline2")
+        self.assertEqual(header.get_header("Content-Length"), "12")
+    
+    def test_parse_without_body(self):
+        """Test that a message ending at the blank line has no body."""
+        header = HTTPHeader("GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+        
+        self.assertIsNone(header.get_body())
+    
+    def test_parse_bytes(self):
+        """Test parsing raw bytes as read from a socket."""
+        header = HTTPHeader(b"GET /caf\xe9 HTTP/1.1\r\nHost: example.com\r\n\r\n")
+        
+        self.assertEqual(header.get_method(), "GET")
+        self.assertEqual(header.get_path(), "/caf\xe9")
+        self.assertEqual(header.get_header("Host"), "example.com")
+    
+    def test_parse_interns_method_and_version(self):
+        """Test that parsed methods and versions are the shared constants."""
+        header = HTTPHeader(b"CONNECT example.com:443 HTTP/1.1\r\n\r\n")
+        response = HTTPHeader(b"HTTP/1.1 200 OK\r\n\r\n")
+        
+        self.assertIs(header.get_method(), HTTPMethod.CONNECT)
+        self.assertIs(header.get_version(), response.get_version())
+    
+    def test_parse_request_line_trailing_whitespace(self):
+        """Test that trailing whitespace and extra words stay out of the version."""
+        for line in ("GET / HTTP/1.1 \r\n\r\n", "GET / HTTP/1.1 extra\r\n\r\n",
+                     "GET / HTTP/1.1\t\n\n"):
+            header = HTTPHeader(line)
+            self.assertIs(header.get_version(), HTTPHeader("GET / HTTP/1.1").get_version())
+            header.set_header("Host", "a")
+            self.assertEqual(header.generate_header(), "GET / HTTP/1.1\r\nHost: a\r\n\r\n")
+    
+    def test_parse_first_line_only(self):
+        """Test a header block without the terminating blank line."""
+        header = HTTPHeader("GET /index.html HTTP/1.0\r\nHost: example.com")
+        
+        self.assertEqual(header.get_method(), "GET")
+        self.assertEqual(header.get_header("Host"), "example.com")
+        self.assertIsNone(header.get_body())
+    
     def test_parse_empty_string(self):
         """Test parsing empty string."""
         header = HTTPHeader("")
@@ -110,13 +165,14 @@ class TestHTTPHeaderLineEndings(unittest.TestCase):
         self.assertEqual(header.get_header("Host"), "example.com")
     
     def test_parse_with_cr(self):
-        """Test parsing with CR (\\r) line endings."""
+        """Test that a lone CR (\\r) is not treated as a line ending."""
         header_str = "GET /test HTTP/1.1\rHost: example.com\r\r"
         header = HTTPHeader(header_str)
         
         self.assertEqual(header.get_method(), "GET")
         self.assertEqual(header.get_path(), "/test")
-        self.assertEqual(header.get_header("Host"), "example.com")
+        self.assertIsNone(header.get_header("Host"))
+        self.assertIsNone(header.get_body())
     
     def test_parse_mixed_line_endings(self):
         """Test parsing with mixed line endings."""
@@ -124,9 +180,24 @@ class TestHTTPHeaderLineEndings(unittest.TestCase):
         header = HTTPHeader(header_str)
         
         self.assertEqual(header.get_method(), "GET")
+        self.assertEqual(header.get_version(), "HTTP/1.1")
+        self.assertEqual(header.get_header("Host"), "example.com")
+        self.assertEqual(header.get_header("User-Agent"), "Test")
+        
+        header = HTTPHeader("GET / HTTP/1.1\r\nHost: a\n\n")
+        self.assertEqual(header.get_version(), "HTTP/1.1")
+        self.assertEqual(header.generate_header(), "GET / HTTP/1.1\r\nHost: a\r\n\r\n")
+        header.set_header("Connection", "close")
+        self.assertEqual(header.generate_header(),
+                         "GET / HTTP/1.1\r\nHost: a\r\nConnection: close\r\n\r\n")
+    
+    def test_parse_lf_headers_with_crlf_in_body(self):
+        """Test that an LF blank line ends the headers before a CRLF one in the body."""
+        header_str = "POST /data HTTP/1.1\nHost: example.com\n\nfirst\r\n\r\nsecond"
+        header = HTTPHeader(header_str)
+        
         self.assertEqual(header.get_header("Host"), "example.com")
-        # Note: This might not work perfectly with truly mixed endings,
-        # but we test the tolerance of the parser
+        self.assertEqual(header.get_body(), "first\r\n\r\nsecond")
     
     def test_parse_with_body_lf(self):
         """Test parsing body with LF line endings."""
@@ -175,6 +246,14 @@ class TestHTTPHeaderEditing(unittest.TestCase):
         
         self.assertEqual(header.get_header("Host"), "new.com")
     
+    def test_assign_headers(self):
+        """Test replacing the whole header dictionary."""
+        header = HTTPHeader("GET / HTTP/1.1\r\nHost: old.com\r\n\r\n")
+        header.headers = {"Host": "new.com", "Accept": "*/*"}
+        
+        self.assertEqual(header.get_header("host"), "new.com")
+        self.assertEqual(header.get_header("Accept"), "*/*")
+    
     def test_remove_header(self):
         """Test removing a header."""
         header = HTTPHeader("GET / HTTP/1.1\r\nHost: example.com\r\nUser-Agent: Test\r\n\r\n")
@@ -183,6 +262,16 @@ class TestHTTPHeaderEditing(unittest.TestCase):
         self.assertIsNone(header.get_header("User-Agent"))
         self.assertIsNotNone(header.get_header("Host"))
     
+    def test_get_all_headers_is_read_only(self):
+        """Test that get_all_headers returns a read-only view."""
+        header = HTTPHeader("GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
+        all_headers = header.get_all_headers()
+        
+        with self.assertRaises(TypeError):
+            all_headers["Host"] = "other.com"
+        header.set_header("Accept", "*/*")
+        self.assertEqual(dict(all_headers), {"Host": "example.com", "Accept": "*/*"})
+    
     def test_set_body(self):
         """Test setting message body."""
         header = HTTPHeader("GET / HTTP/1.1\r\n\r\n")
@@ -285,6 +374,60 @@ class TestHTTPHeaderGeneration(unittest.TestCase):
         self.assertEqual(header.get_header("Host"), header2.get_header("Host"))
         self.assertEqual(header.get_header("Content-Type"), header2.get_header("Content-Type"))
     
+    def test_generate_bytes(self):
+        """Test that generate_bytes round-trips raw bytes unchanged."""
+        raw = b"GET /caf\xe9 HTTP/1.1\r\nHost: example.com\r\n\r\n"
+        header = HTTPHeader(raw)
+        
+        self.assertEqual(header.generate_bytes(), raw)
+        self.assertEqual(header.generate_bytes(), header.generate_header().encode("latin-1"))
+    
+    def test_generate_unmodified_returns_raw(self):
+        """Test that an unchanged CRLF message is regenerated verbatim."""
+        raw = "GET /a HTTP/1.1\r\nHost:  example.com\r\nAccept: */*\r\n\r\n"
+        header = HTTPHeader(raw)
+        header.get_header("Host")
+        header.set_header("Accept", "*/*")
+        
+        self.assertIs(header.generate_header(), raw)
+    
+    def test_generate_after_change_rebuilds(self):
+        """Test that any change makes generate_header rebuild the message."""
+        raw = "GET /a HTTP/1.1\r\nHost:  example.com\r\n\r\n"
+        
+        header = HTTPHeader(raw)
+        header.set_header("Connection", "close")
+        self.assertEqual(header.generate_header(),
+                         "GET /a HTTP/1.1\r\nHost: example.com\r\nConnection: close\r\n\r\n")
+        
+        header = HTTPHeader(raw)
+        header.set_version("HTTP/1.0")
+        self.assertEqual(header.generate_header(),
+                         "GET /a HTTP/1.0\r\nHost: example.com\r\n\r\n")
+    
+    def test_generate_unterminated_raw(self):
+        """Test that a raw header block without its blank line gets one."""
+        header = HTTPHeader("GET /a HTTP/1.1\r\nHost: example.com")
+        
+        self.assertEqual(header.generate_header(),
+                         "GET /a HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    
+    def test_iovecs_match_generate_bytes(self):
+        """Test that the iovec segments join into the generated message."""
+        changed = HTTPHeader("POST / HTTP/1.1\r\nHost: example.com\r\n\r\nTest Body")
+        changed.set_header("Connection", "close")
+        messages = [
+            changed,
+            HTTPHeader("POST / HTTP/1.1\r\nHost: example.com\r\n\r\nTest Body"),
+            HTTPHeader("GET / HTTP/1.1\nHost: example.com\n\n"),
+        ]
+        
+        for header in messages:
+            segments = header.iovecs()
+            self.assertEqual(b"".join(segments), header.generate_bytes())
+            self.assertTrue(all(segments))
+        self.assertEqual(len(messages[1].iovecs()), 3)
+    
     def test_str_method(self):
         """Test __str__ method returns same as generate_header."""
         header = HTTPHeader("GET / HTTP/1.1\r\nHost: example.com\r\n\r\n")
@@ -334,6 +477,30 @@ class TestHTTPHeaderEdgeCases(unittest.TestCase):
         
         self.assertEqual(header.get_path(), "/page#section")
     
+    def test_get_header_case_insensitive(self):
+        """Test that header lookups ignore case."""
+        header = HTTPHeader("GET / HTTP/1.1\r\nhost: example.com\r\nX-Custom: 1\r\n\r\n")
+        
+        self.assertEqual(header.get_header("Host"), "example.com")
+        self.assertEqual(header.get_header("HOST"), "example.com")
+        self.assertEqual(header.get_header("x-custom"), "1")
+    
+    def test_set_header_case_insensitive(self):
+        """Test that setting a header in another case updates the existing field."""
+        header = HTTPHeader("GET / HTTP/1.1\r\nconnection: keep-alive\r\n\r\n")
+        header.set_header("Connection", "close")
+        
+        self.assertEqual(header.get_all_headers(), {"connection": "close"})
+        self.assertIn("connection: close", header.generate_header())
+    
+    def test_remove_header_case_insensitive(self):
+        """Test removing a header using a different case."""
+        header = HTTPHeader("GET / HTTP/1.1\r\nProxy-Connection: keep-alive\r\n\r\n")
+        header.remove_header("proxy-connection")
+        
+        self.assertIsNone(header.get_header("Proxy-Connection"))
+        self.assertEqual(len(header.get_all_headers()), 0)
+    
     def test_get_nonexistent_header(self):
         """Test getting a header that doesn't exist."""
         header = HTTPHeader("GET / HTTP/1.1\r\n\r\n")
@@ -347,6 +514,14 @@ class TestHTTPHeaderEdgeCases(unittest.TestCase):
         
         self.assertIsNone(header.get_header("NonExistent"))
     
+    def test_no_instance_dict(self):
+        """Test that instances use fixed slots rather than a __dict__."""
+        header = HTTPHeader("GET / HTTP/1.1\r\n\r\n")
+        
+        self.assertFalse(hasattr(header, "__dict__"))
+        with self.assertRaises(AttributeError):
+            header.unknown_field = "value"
+    
     def test_repr_request(self):
         """Test __repr__ for request."""
         header = HTTPHeader("GET /test HTTP/1.1\r\n\r\n")
@@ -365,5 +540,74 @@ class TestHTTPHeaderEdgeCases(unittest.TestCase):
         self.assertIn("OK", repr_str)
 
 
+
+class TestHTTPHeaderPool(unittest.TestCase):
+    """Test reuse of HTTPHeader instances."""
+    
+    def setUp(self):
+        HTTPHeader._pool.clear()
+    
+    def test_acquire_reuses_released_instance(self):
+        """Test that acquire hands back a released instance, freshly parsed."""
+        first = HTTPHeader.acquire("POST /a HTTP/1.1\r\nHost: a.com\r\n\r\nbody")
+        first.release()
+        second = HTTPHeader.acquire("GET /b HTTP/1.0\r\nAccept: */*\r\n\r\n")
+        
+        self.assertIs(first, second)
+        self.assertEqual(second.get_method(), "GET")
+        self.assertEqual(second.get_path(), "/b")
+        self.assertEqual(second.get_all_headers(), {"Accept": "*/*"})
+        self.assertIsNone(second.get_body())
+    
+    def test_scoped_releases_on_exit(self):
+        """Test that scoped returns the header to the pool."""
+        with HTTPHeader.scoped("HTTP/1.1 200 OK\r\n\r\n") as header:
+            self.assertEqual(header.get_status_code(), 200)
+        
+        self.assertIs(HTTPHeader.acquire(""), header)
+        self.assertTrue(header.is_request)
+        self.assertIsNone(header.get_status_code())
+
+
+class TestHTTPHeaderMethodTable(unittest.TestCase):
+    """Test the generated request-line parser."""
+    
+    def tearDown(self):
+        HTTPHeader.install_method_table([])
+    
+    def test_method_table_matches_generic_parser(self):
+        """Test that the specialized parser gives the same results."""
+        lines = [
+            "GET /index.html HTTP/1.1\r\nHost: example.com\r\n\r\n",
+            "POST http://example.com/submit HTTP/1.0\r\n\r\n",
+            "DELETE /item/1 HTTP/1.1\r\n\r\n",
+            "GET /a b HTTP/1.1\r\n\r\n",
+            "GET  /spaced HTTP/1.1\r\n\r\n",
+            "HTTP/1.1 200 OK\r\n\r\n",
+        ]
+        expected = [repr(HTTPHeader(line)) for line in lines]
+        
+        HTTPHeader.install_method_table(["GET", "POST"])
+        
+        self.assertEqual([repr(HTTPHeader(line)) for line in lines], expected)
+        self.assertIs(HTTPHeader(lines[0]).get_method(), HTTPMethod.GET)
+    
+    def test_method_table_matches_generic_parser_on_whitespace(self):
+        """Test that whitespace other than single spaces takes the generic path."""
+        lines = [f"GET /a{ws}b HTTP/1.1\r\n\r\n"
+                 for ws in ("\t", "\x0b", "\x0c", "\x1c", "\xa0", "\u3000")]
+        lines += ["GET \t/a HTTP/1.1\r\n\r\n", "GET /a \tHTTP/1.1\r\n\r\n",
+                  "GET /a HTTP/1.1 \r\n\r\n"]
+        expected = [repr(HTTPHeader(line)) for line in lines]
+        
+        HTTPHeader.install_method_table(["GET"])
+        
+        self.assertEqual([repr(HTTPHeader(line)) for line in lines], expected)
+    
+    def test_method_table_rejects_invalid_method(self):
+        """Test that methods must be plain tokens."""
+        with self.assertRaises(ValueError):
+            HTTPHeader.install_method_table(["GET'"])
+
 if __name__ == '__main__':
     unittest.main()
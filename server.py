@@ -1,52 +1,179 @@
 # Lab 3 Proxy Server
-from pstats import SortKey
-import select
+import argparse
+import asyncio
+import logging
+import os
+import re
+import signal
 import sys
 import socket
-import struct
-import threading
-from typing import Tuple
+import time
+from typing import BinaryIO, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 import http_parser
 
 # Constants
 DEBUG = False
 
+log = logging.getLogger("proxy")
+
 MIN_PORT = 1024
 MAX_PORT = 65535
 
-BUF_SIZE = 1024
+# Smallest chunk the proxy reads at a time. serve() raises it to match
+# the kernel's receive buffer, capped at MAX_BUF_SIZE
+BUF_SIZE = 65536
+MAX_BUF_SIZE = 1 << 20
 
-# Global list of sockets for cleanup
-sockets = []
-sockets_lock = threading.Lock()
+# Whether to keep upstream connections open for reuse (--keep-alive), and
+# how many idle ones to hold per origin
+KEEP_ALIVE = False
+POOL_SIZE = 8
 
-def add_socket(sock):
-    with sockets_lock:
-        sockets.append(sock)
+# Most idle upstream connections kept across all origins together
+POOL_TOTAL_SIZE = 256
 
-def cleanup_socket(sock):
-    with sockets_lock:
-        if sock in sockets:
-            sockets.remove(sock)
-    sock.close()
+# Seconds an idle upstream connection is kept before it is closed instead
+# of reused; origins commonly drop idle connections not long after this
+POOL_IDLE_TIMEOUT = 30
 
-def cleanup_all_sockets():
-    with sockets_lock:
-        for sock in sockets:
-            sock.close()
-        sockets.clear()
+# Seconds a resolved upstream address is reused, and how many are kept
+DNS_TTL = 60
+DNS_CACHE_SIZE = 1024
+
+# Resolved addresses, keyed by (host, port), as (expiry, sockaddr)
+dns_cache: Dict[Tuple[str, int], Tuple[float, Tuple[str, int]]] = {}
+
+# Idle upstream connections as (idle_since, socket), keyed by (host, port)
+upstream_pool: Dict[Tuple[str, int], List[Tuple[float, socket.socket]]] = {}
+
+# Socket buffer size from --window. None leaves the kernel's buffer
+# autotuning in charge, which is almost always what we want
+WINDOW: Optional[int] = None
+
+# Capacity requested for splice pipes; the kernel caps unprivileged
+# processes at fs.pipe-max-size (1 MiB by default)
+PIPE_SIZE = 1 << 20
+
+# Empty splice pipes kept for reuse by acquire_pipe/release_pipe
+PIPE_POOL_SIZE = 32
+pipe_pool: List[Tuple[int, int, int]] = []
+
+# Seconds to wait on a single receive before giving up on the peer
+TIMEOUT = 5
+
+# TCP_QUICKACK is Linux only
+QUICKACK = hasattr(socket, "TCP_QUICKACK")
+
+# Most connections handled at once; clients beyond this get a 503.
+# serve() lowers it to what the open file limit can hold: a spliced
+# tunnel needs FDS_PER_CONNECTION descriptors (two sockets, two pipe
+# ends), and FD_RESERVE are kept back for the listener and stdio on top
+# of what the pipe and upstream pools can hold
+MAX_CONNECTIONS = 1024
+FDS_PER_CONNECTION = 6
+FD_RESERVE = 32
+
+# Seconds to stop accepting after accept() itself fails, e.g. when the
+# process is out of file descriptors
+ACCEPT_BACKOFF = 0.1
+
+# Canned replies the proxy sends on its own behalf
+CONNECTION_ESTABLISHED = b"HTTP/1.0 200 Connection Established\r\n\r\n"
+BAD_REQUEST = b"HTTP/1.0 400 Bad Request\r\n\r\n"
+HEADER_TOO_LARGE = b"HTTP/1.0 431 Request Header Fields Too Large\r\n\r\n"
+BAD_GATEWAY = b"HTTP/1.0 502 Bad Gateway\r\n\r\n"
+SERVICE_UNAVAILABLE = b"HTTP/1.0 503 Service Unavailable\r\n\r\n"
 
-def main(args):
+# Blank line ending a header block, accepting bare LF line endings too
+HEADER_END = re.compile(rb"\r?\n\r?\n")
+
+# A chunk size: hex digits only, with no sign, prefix, separator or space
+CHUNK_SIZE = re.compile(rb"[0-9A-Fa-f]{1,16}")
+
+# Largest header block read from a peer before giving up on it
+MAX_HEADER_SIZE = 1 << 16
+
+# Receive buffers kept for reuse by acquire_buf/release_buf
+BUF_POOL_SIZE = 64
+buf_pool: List[bytearray] = []
+
+def tune_socket(sock: socket.socket) -> None:
+    '''
+    Disables Nagle's algorithm on a socket so small writes (handshake
+    replies, interactive tunnel traffic) go out at once, and applies the
+    --window override to its send and receive buffers. The buffer sizes
+    are only touched when the flag was given, since fixing them turns off
+    the kernel's autotuning.
+    '''
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if WINDOW is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, WINDOW)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, WINDOW)
+
+def quick_ack(sock: socket.socket) -> None:
+    '''
+    Asks the kernel to ACK what arrives on a socket right away rather than
+    delaying the ACK. Linux only, and not sticky: the kernel can drop back
+    to delayed ACKs after later receives, so hot paths re-arm it.
+    '''
+    if QUICKACK:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+def trace(line: str) -> None:
+    '''
+    Writes one line of per-request output straight to stdout with
+    os.write, bypassing sys.stdout's buffer and lock. Lines up to PIPE_BUF
+    bytes go out in one write, so forked workers sharing a terminal or pipe
+    don't interleave them; a longer line is written in as many pieces as
+    it takes.
+    Parameters:
+    - line: text to write, without a trailing newline
+    '''
+    data = memoryview(line.encode("utf-8", "replace") + b"\n")
+    try:
+        while data:
+            data = data[os.write(1, data):]
+    except OSError:
+        pass
+
+def main(args: List[str]) -> None:
     '''
     Checks for valid arguments and begins proxy server.
     '''
-    # Ensure correct arg length
-    if (len(args) != 2):
-        usage(args)
-        sys.exit()
-    
-    port = int(args[1])
+    global KEEP_ALIVE, WINDOW
+
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.WARNING,
+                        format="%(asctime)s %(process)d %(message)s")
+
+    parser = argparse.ArgumentParser(prog=args[0])
+    parser.add_argument("port", type=int, help="port to run server on")
+    parser.add_argument("--window", type=int, metavar="N",
+                        help="force SO_RCVBUF/SO_SNDBUF to N bytes on every socket")
+    parser.add_argument("--keep-alive", action="store_true",
+                        help="reuse upstream connections across requests")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="number of processes sharing the port, one per core")
+    options = parser.parse_args(args[1:])
+
+    if options.workers < 1:
+        parser.error("--workers must be at least 1")
+    if options.workers > 1 and not (hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")):
+        parser.error("--workers needs fork() and SO_REUSEPORT")
+
+    port = options.port
+    KEEP_ALIVE = options.keep_alive
+    WINDOW = options.window
 
     # Check for a valid port
     if port < MIN_PORT or port > MAX_PORT:
@@ -54,290 +181,852 @@ def main(args):
         sys.exit()
 
     # Run the server
-    server(port)
+    server(port, options.workers)
+
+def server(port: int, workers: int = 1) -> None:
+    '''
+    Runs the proxy in the given number of processes. Each one binds its own
+    listener to the port with SO_REUSEPORT, so the kernel spreads incoming
+    connections across them, and runs its own event loop pinned to one
+    core. The first process is this one; the others are forked children
+    that it stops again on the way out.
+    Parameters:
+    - port: port to run server on
+    - workers: number of processes
+    '''
+    children = []
+    for index in range(1, workers):
+        pid = os.fork()
+        if pid == 0:
+            # Never unwind into the parent's code, even if serve() fails
+            status = 1
+            try:
+                serve(port, index, workers)
+                status = 0
+            except BaseException:
+                log.exception("Worker %d failed", index)
+            finally:
+                os._exit(status)
+        children.append(pid)
+
+    if children:
+        # Make a plain kill of the parent unwind through the finally below,
+        # taking the children down with it
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-def server(port):
+    try:
+        serve(port, 0, workers)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+def serve(port: int, index: int, workers: int) -> None:
     '''
-    Handles incoming connections and spawns threads for each new one. 
-    Additioanlly cleans up sockets on server close.
+    Sets up the listening socket and runs the event loop that handles
+    incoming connections. Stopping the loop cancels every worker, and
+    each worker closes its own sockets on the way out.
     Parameters:
     - port: port to run server on
+    - index: which of the server processes this is
+    - workers: total number of server processes
     '''
 
     # Create a TCP listening port
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    with sockets_lock:
-        sockets.append(listener)
 
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
-    print(f"Listening on port {port}")
-    print("Press Ctrl+C to stop the server")
+    tune_socket(listener)
+
+    # Accepted sockets inherit the listener's receive buffer, so read in
+    # chunks of that size and a single recv can drain a full buffer. This
+    # only reads the kernel's choice; it never forces one
+    global BUF_SIZE, MAX_CONNECTIONS
+    rcvbuf = listener.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    BUF_SIZE = min(max(BUF_SIZE, rcvbuf), MAX_BUF_SIZE)
+
+    # Turn clients away with a 503 before the process runs out of file
+    # descriptors, rather than failing in the middle of their requests
+    if resource is not None:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            reserve = FD_RESERVE + 2 * PIPE_POOL_SIZE
+            if KEEP_ALIVE:
+                reserve += POOL_TOTAL_SIZE
+            fit = (soft - reserve) // FDS_PER_CONNECTION
+            MAX_CONNECTIONS = max(1, min(MAX_CONNECTIONS, fit))
+
+    if workers > 1:
+        # Only share the port when asked to, so a lone proxy still fails
+        # loudly if something else is already listening on it
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if hasattr(os, "sched_setaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+
+    if index == 0:
+        print(f"Listening on port {port}")
+        print("Press Ctrl+C to stop the server", flush=True)
         
     listener.bind(('', port))
-    listener.listen(5)
+    listener.listen(socket.SOMAXCONN)
+    listener.setblocking(False)
     
     try:
-        while True:
-            client_socket, client_address = listener.accept()
-            client_socket.settimeout(5)
-
-            if DEBUG:
-                print(f"Accepted connection from {client_address}")
-            thread = threading.Thread(target=worker, args=(client_socket, client_address))
-            thread.daemon = True
-            thread.start()
+        asyncio.run(accept_loop(listener))
     except KeyboardInterrupt:
-        if DEBUG:
-            print("\nKeyboard interrupt received. Shutting down server...")
+        log.debug("Keyboard interrupt received. Shutting down server...")
     finally:
         listener.close()
-        cleanup_all_sockets()
-        if DEBUG:
-            print("Server stopped")
+        log.debug("Server stopped")
+
+async def accept_loop(listener: socket.socket) -> None:
+    '''
+    Accepts incoming connections on a single event loop and spawns a
+    worker task for each new one. The loop waits on epoll (or the
+    platform's best selector), so idle connections cost no CPU. Once
+    MAX_CONNECTIONS are open, new clients are turned away with a 503.
+    Parameters:
+    - listener: bound, listening, non-blocking socket
+    '''
+    loop = asyncio.get_running_loop()
+
+    # The loop only keeps weak references to tasks, so hold on to them
+    # until they finish
+    tasks: Set[asyncio.Task] = set()
+    while True:
+        try:
+            client_socket, client_address = await loop.sock_accept(listener)
+        except OSError as e:
+            # Out of descriptors or buffers; the connection waits in the
+            # backlog until a finished worker frees something up
+            log.warning("accept failed: %s", e)
+            await asyncio.sleep(ACCEPT_BACKOFF)
+            continue
+        tune_socket(client_socket)
+
+        if len(tasks) >= MAX_CONNECTIONS:
+            log.debug("Too many connections, rejecting %s", client_address)
+            try:
+                # A fresh socket's send buffer always has room for this
+                client_socket.send(SERVICE_UNAVAILABLE)
+            except OSError:
+                pass
+            client_socket.close()
+            continue
+
+        log.debug("Accepted connection from %s", client_address)
+        task = loop.create_task(worker(client_socket, client_address))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+def acquire_buf() -> bytearray:
+    '''
+    Returns a BUF_SIZE bytearray to receive into, reusing a released one
+    if one is free.
+    '''
+    try:
+        return buf_pool.pop()
+    except IndexError:
+        return bytearray(BUF_SIZE)
+
+def release_buf(buf: bytearray) -> None:
+    '''
+    Hands a buffer from acquire_buf back for reuse. Buffers that had to
+    grow are dropped so every pooled buffer stays BUF_SIZE.
+    '''
+    if len(buf) == BUF_SIZE and len(buf_pool) < BUF_POOL_SIZE:
+        buf_pool.append(buf)
+
+async def recv_into(sock: socket.socket, view: Union[bytearray, memoryview],
+                    timeout: Optional[float] = TIMEOUT) -> int:
+    '''
+    Receives into a writable buffer, returning the number of bytes read
+    and raising asyncio.TimeoutError if nothing arrives within timeout
+    seconds.
+    Parameters:
+    - sock: non-blocking socket to read from
+    - view: buffer (or memoryview slice) to fill
+    - timeout: seconds to wait, or None to wait forever
+    '''
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.sock_recv_into(sock, view), timeout)
+
+async def read_header(sock: socket.socket) -> Optional[Tuple[bytes, bytes]]:
+    '''
+    Reads from a socket until the blank line ending a header block, with
+    either CRLF or bare LF line endings. Data is received straight into a
+    pooled bytearray, grown if the header outlasts it, and only the newly
+    arrived bytes are searched, in a single pass for both terminator forms.
+    Returns (raw_header, leftover), where leftover holds any bytes that
+    arrived after the header, or None if the peer closed first. Raises
+    asyncio.TimeoutError if the peer goes quiet for TIMEOUT seconds, and
+    ValueError if the header runs past MAX_HEADER_SIZE.
+    Parameters:
+    - sock: non-blocking socket to read from
+    '''
+    buf = acquire_buf()
+    pos = 0
+    try:
+        while True:
+            if pos == len(buf):
+                buf.extend(bytes(len(buf)))
+            n = await recv_into(sock, memoryview(buf)[pos:])
+            if n == 0:
+                return None
+
+            # The terminator may straddle the previous receive
+            end = HEADER_END.search(buf, max(0, pos - 3), pos + n)
+            pos += n
+            if end:
+                # Copy straight out of the buffer, not via a bytearray slice
+                with memoryview(buf) as view:
+                    return bytes(view[:end.start()]), bytes(view[end.end():pos])
+            if pos >= MAX_HEADER_SIZE:
+                raise ValueError(f"header longer than {MAX_HEADER_SIZE} bytes")
+    finally:
+        release_buf(buf)
+
+async def wait_ready(sock: socket.socket, write: bool = False,
+                     timeout: Optional[float] = TIMEOUT) -> None:
+    '''
+    Waits until a socket is readable, or writable if write is set, raising
+    asyncio.TimeoutError if that takes more than timeout seconds.
+    Parameters:
+    - sock: non-blocking socket to wait on
+    - write: wait for writability instead of readability
+    - timeout: seconds to wait, or None to wait forever
+    '''
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def wake():
+        if not ready.done():
+            ready.set_result(None)
+
+    fd = sock.fileno()
+    if write:
+        loop.add_writer(fd, wake)
+    else:
+        loop.add_reader(fd, wake)
+    try:
+        await asyncio.wait_for(ready, timeout)
+    finally:
+        if write:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+async def send_buffers(sock: socket.socket, buffers: Sequence[bytes]) -> None:
+    '''
+    Writes several buffers to a socket in order using sendmsg, so they go
+    out in one syscall (when the socket has room) without first being
+    joined into a new bytes object. Falls back to a joined sendall where
+    sendmsg is unavailable.
+    Parameters:
+    - sock: non-blocking socket to write to
+    - buffers: bytes-like objects to send back to back
+    '''
+    if not hasattr(sock, "sendmsg"):
+        await asyncio.get_running_loop().sock_sendall(sock, b"".join(buffers))
+        return
+
+    views = [memoryview(buf) for buf in buffers if len(buf)]
+    while views:
+        try:
+            sent = sock.sendmsg(views)
+        except BlockingIOError:
+            await wait_ready(sock, write=True)
+            continue
+
+        # Drop the buffers that went out whole and trim a partial one
+        while views and sent >= views[0].nbytes:
+            sent -= views.pop(0).nbytes
+        if sent:
+            views[0] = views[0][sent:]
+
+def acquire_pipe() -> Tuple[int, int, int]:
+    '''
+    Returns (read_fd, write_fd, capacity) for an empty pipe to splice
+    through, reusing a released one if one is free. New pipes are grown to
+    PIPE_SIZE where the platform allows so each splice can move more than
+    the default 64 KiB.
+    '''
+    try:
+        return pipe_pool.pop()
+    except IndexError:
+        pass
+
+    pipe_r, pipe_w = os.pipe()
+    capacity = BUF_SIZE
+    if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            capacity = fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+        except OSError:
+            pass
+    return pipe_r, pipe_w, capacity
+
+def release_pipe(pipe: Tuple[int, int, int], empty: bool) -> None:
+    '''
+    Hands a pipe from acquire_pipe back for reuse. A pipe that may still
+    hold bytes is closed instead, since they would leak into the next
+    relay that used it.
+    Parameters:
+    - pipe: (read_fd, write_fd, capacity) from acquire_pipe
+    - empty: whether everything spliced into the pipe was spliced out
+    '''
+    if empty and len(pipe_pool) < PIPE_POOL_SIZE:
+        pipe_pool.append(pipe)
+    else:
+        os.close(pipe[0])
+        os.close(pipe[1])
+
+async def splice_body(src: socket.socket, dst: socket.socket, remaining: Optional[int] = None,
+                      timeout: Optional[float] = TIMEOUT, quickack: bool = False) -> Optional[int]:
+    '''
+    Forwards the next remaining bytes src sends to dst, or everything until
+    src closes if remaining is None. Stops early if src closes or goes
+    quiet for timeout seconds. On Linux the bytes are moved through a
+    kernel pipe with os.splice and never copied into Python; elsewhere this
+    falls back to a recv/sendall loop.
+    Parameters:
+    - src: socket to read from
+    - dst: socket to write to
+    - remaining: number of bytes to forward, or None to read to EOF
+    - timeout: seconds either socket may stall, or None to wait forever
+    - quickack: re-arm TCP_QUICKACK on src after every read
+    Returns how many of the remaining bytes were not forwarded, or None
+    if reading to EOF.
+    '''
+    if not hasattr(os, "splice"):
+        # Relay through one pooled buffer instead of a new bytes per read
+        loop = asyncio.get_running_loop()
+        buf = acquire_buf()
+        try:
+            with memoryview(buf) as view:
+                while remaining is None or remaining > 0:
+                    size = BUF_SIZE if remaining is None else min(BUF_SIZE, remaining)
+                    try:
+                        n = await recv_into(src, view[:size], timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if n == 0:
+                        break
+                    if quickack:
+                        quick_ack(src)
+                    await loop.sock_sendall(dst, view[:n])
+                    if remaining is not None:
+                        remaining -= n
+        finally:
+            release_buf(buf)
+        return remaining
+
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    pipe = acquire_pipe()
+    pipe_r, pipe_w, capacity = pipe
+    n = 0
+    try:
+        while remaining is None or remaining > 0:
+            size = capacity if remaining is None else min(capacity, remaining)
+            try:
+                n = os.splice(src.fileno(), pipe_w, size, flags=flags)
+            except BlockingIOError:
+                try:
+                    await wait_ready(src, timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            if n == 0:
+                break
+            if quickack:
+                quick_ack(src)
+            if remaining is not None:
+                remaining -= n
+
+            # Drain the pipe completely so the next read starts empty. Tell
+            # the kernel when more of a known-length body is on its way
+            out_flags = flags | os.SPLICE_F_MORE if remaining else flags
+            while n:
+                try:
+                    n -= os.splice(pipe_r, dst.fileno(), n, flags=out_flags)
+                except BlockingIOError:
+                    await wait_ready(dst, write=True, timeout=timeout)
+    finally:
+        release_pipe(pipe, n == 0)
+    return remaining
+
+async def forward_known_length(src: Union[socket.socket, BinaryIO], dst: socket.socket,
+                               count: int) -> bool:
+    '''
+    Forwards exactly count bytes from src to dst. A socket source is
+    spliced; a regular file opened in binary mode is handed to
+    loop.sock_sendfile, which uses sendfile(2) where the platform has it.
+    Returns True if all count bytes were forwarded.
+    Parameters:
+    - src: socket or binary file to read from
+    - dst: socket to write to
+    - count: number of bytes to forward
+    '''
+    if count <= 0:
+        return count == 0
+    if isinstance(src, socket.socket):
+        return await splice_body(src, dst, count) == 0
+    loop = asyncio.get_running_loop()
+    return await loop.sock_sendfile(dst, src, count=count) == count
+
+def is_chunked(header: http_parser.HTTPHeader) -> bool:
+    '''
+    Returns whether a message's body uses chunked transfer coding, which
+    must be the last coding listed.
+    '''
+    codings = header.get_header("Transfer-Encoding")
+    return codings is not None and codings.rsplit(",", 1)[-1].strip().lower() == "chunked"
+
+def response_has_body(method: Optional[str], resp_header: http_parser.HTTPHeader) -> bool:
+    '''
+    Returns whether a response carries a body at all. HEAD responses and
+    1xx, 204 and 304 responses never do, whatever their headers say.
+    '''
+    status = resp_header.get_status_code() or 0
+    return method != "HEAD" and status >= 200 and status not in (204, 304)
+
+async def forward_chunked(src: socket.socket, dst: socket.socket, data: bytes) -> bool:
+    '''
+    Forwards a chunked body from src to dst as it arrives, parsing only the
+    chunk-size lines so it knows where the body ends. Chunk data is
+    skipped over, never buffered.
+    Returns True once the final chunk and trailers have been forwarded
+    with nothing after them, or False if src closed first or sent bytes
+    past the end of the body (they are forwarded all the same). Raises asyncio.TimeoutError if src goes
+    quiet for TIMEOUT seconds, and ValueError on a malformed chunk size,
+    since the two ends could then disagree about where the body stops.
+    Parameters:
+    - src: socket to read from
+    - dst: socket to write to
+    - data: body bytes already received (and already sent on to dst)
+    '''
+    loop = asyncio.get_running_loop()
+    buf = bytearray(data)
+    chunk = acquire_buf()
+    skip = 0
+    trailers = False
+    try:
+        while True:
+            # Consume every complete piece of framing we have so far
+            while True:
+                if skip:
+                    n = min(skip, len(buf))
+                    del buf[:n]
+                    skip -= n
+                    if skip:
+                        break
+                newline = buf.find(b"\n")
+                if newline == -1:
+                    break
+                line = bytes(buf[:newline])
+                del buf[:newline + 1]
+                if line.endswith(b"\r"):
+                    line = line[:-1]
+                if trailers:
+                    # The trailer section ends with an empty line
+                    if not line:
+                        return not buf
+                else:
+                    # Only whitespace before a chunk extension is allowed
+                    token, ext, _ = line.partition(b";")
+                    if ext:
+                        token = token.rstrip(b" \t")
+                    if not CHUNK_SIZE.fullmatch(token):
+                        raise ValueError(f"invalid chunk size {line!r}")
+                    size = int(token, 16)
+                    if size == 0:
+                        trailers = True
+                    else:
+                        # Chunk data is followed by its own CRLF
+                        skip = size + 2
+
+            n = await recv_into(src, chunk)
+            if n == 0:
+                return False
+            with memoryview(chunk)[:n] as data:
+                await loop.sock_sendall(dst, data)
+
+                # buf is empty while skip is set, so chunk data can be
+                # skipped straight out of the receive buffer; only framing
+                # is ever copied into buf
+                start = min(skip, n)
+                skip -= start
+                buf += data[start:]
+    finally:
+        release_buf(chunk)
+
+async def resolve(host: str, port: int) -> Tuple[str, int]:
+    '''
+    Returns an IPv4 socket address for host:port, reusing a cached lookup
+    for up to DNS_TTL seconds so hot origins skip getaddrinfo (which runs
+    in a worker thread) on every request.
+    Parameters:
+    - host: destination host
+    - port: destination port
+    '''
+    key = (host, port)
+    now = time.monotonic()
+    cached = dns_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_STREAM)
+    sockaddr = infos[0][4]
+
+    # Evict the oldest entry rather than let the cache grow without bound
+    dns_cache.pop(key, None)
+    if len(dns_cache) >= DNS_CACHE_SIZE:
+        del dns_cache[next(iter(dns_cache))]
+    dns_cache[key] = (now + DNS_TTL, sockaddr)
+    return sockaddr
+
+async def open_upstream(host: str, port: int) -> socket.socket:
+    '''
+    Returns a connected socket to host:port, reusing the most recently
+    parked idle connection that has neither expired nor been closed by the
+    origin. Stale ones found on the way are closed.
+    Parameters:
+    - host: destination host
+    - port: destination port
+    '''
+    idle = upstream_pool.get((host, port))
+    if idle:
+        now = time.monotonic()
+        while idle:
+            idle_since, sock = idle.pop()
+            if now - idle_since < POOL_IDLE_TIMEOUT and is_idle_alive(sock):
+                return sock
+            sock.close()
+        del upstream_pool[(host, port)]
+
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        tune_socket(sock)
+        await loop.sock_connect(sock, await resolve(host, port))
+        quick_ack(sock)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+def release_upstream(host: str, port: int, sock: socket.socket) -> None:
+    '''
+    Parks an upstream connection for the next request to the same origin,
+    or closes it if that origin already has POOL_SIZE idle connections.
+    Connections that have idled out are closed on the way, whichever
+    origin they belong to, and once POOL_TOTAL_SIZE are parked the one
+    idle the longest makes room.
+    Parameters:
+    - host: destination host
+    - port: destination port
+    - sock: connection with no request in flight
+    '''
+    now = time.monotonic()
+    total = 0
+    for key in list(upstream_pool):
+        # Each list is in parking order, so expired entries are at the front
+        idle = upstream_pool[key]
+        while idle and now - idle[0][0] >= POOL_IDLE_TIMEOUT:
+            idle.pop(0)[1].close()
+        if idle:
+            total += len(idle)
+        else:
+            del upstream_pool[key]
+
+    idle = upstream_pool.get((host, port), [])
+    if len(idle) >= POOL_SIZE:
+        sock.close()
+        return
+    if total >= POOL_TOTAL_SIZE:
+        oldest = min(upstream_pool, key=lambda key: upstream_pool[key][0][0])
+        upstream_pool[oldest].pop(0)[1].close()
+        if not upstream_pool[oldest]:
+            del upstream_pool[oldest]
+    upstream_pool.setdefault((host, port), idle).append((now, sock))
+
+def is_idle_alive(sock: socket.socket) -> bool:
+    '''
+    Returns whether a parked upstream connection can still carry a request.
+    An idle connection should have nothing to read: EOF means the origin
+    closed it, and stray bytes mean it is out of step with us.
+    '''
+    try:
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            return False
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
 
-def worker(client_socket, client_address):
+def upstream_keeps_alive(resp_header: http_parser.HTTPHeader) -> bool:
     '''
-    Worker function that each thread executes
+    Returns whether the upstream server will keep the connection open after
+    the given response.
+    '''
+    connection = (resp_header.get_header("Connection") or "").lower()
+    if resp_header.get_version() == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+async def pipe(src: socket.socket, dst: socket.socket) -> None:
+    '''
+    Copies data from src to dst until src closes the connection, then
+    passes the close on by shutting down the write side of dst. Tunnels
+    may sit idle indefinitely, so there is no timeout, and the bytes are
+    spliced through the kernel where possible.
+    Parameters:
+    - src: socket to read from
+    - dst: socket to write to
+    '''
+    await splice_body(src, dst, timeout=None, quickack=True)
+    dst.shutdown(socket.SHUT_WR)
+
+async def worker(client_socket: socket.socket, client_address: Tuple[str, int]) -> None:
+    '''
+    Worker coroutine that each connection runs as its own task
     Parameters:
     - client_socket: connection object for the client
     - client_address: client address info
     '''
-    if DEBUG:
-        print(f"Client address info: {client_address}")
+    log.debug("Client address info: %s", client_address)
 
+    dest_socket = None
     try :
-        packet_buf = b""
-
         # First just get the header
-        delim = b"\r\n\r\n"
         try:
-            while packet_buf.find(delim) == -1 and packet_buf.find(b"\n\n") == -1:
-                if packet_buf.find(b"\n\n") != -1:
-                    delim = b"\n\n"
-                packet_buf += client_socket.recv(BUF_SIZE)
-        except TimeoutError as e:
-            if DEBUG:
-                print(f"Timed out: {e}")
-                print(packet_buf.decode())
-            
-            # Cleanup socket
-            cleanup_socket(client_socket)
-                
+            result = await read_header(client_socket)
+            if result is None:
+                # Client hung up before finishing its request
+                return
+        except asyncio.TimeoutError as e:
+            log.debug("Timed out: %s", e)
             return
         except ConnectionResetError as e:
-            if DEBUG:
-                print(f"Connection reset: {e}")
-
-            # Cleanup socket
-            cleanup_socket(client_socket)
+            log.debug("Connection reset: %s", e)
+            return
+        except ValueError as e:
+            log.debug("Rejecting request: %s", e)
+            try:
+                await asyncio.get_running_loop().sock_sendall(client_socket, HEADER_TOO_LARGE)
+            except OSError:
+                pass
             return
 
-        # Update buffer
-        packet_buf = packet_buf.split(delim, 1)
-        raw_header = packet_buf[0]
-        if len(packet_buf) == 1:
-            print(packet_buf[0])
-        packet_buf = packet_buf[1]
-        header = http_parser.HTTPHeader(raw_header.decode())
-        header.set_header("Connection", "close")
-        header.set_version("HTTP/1.0")
-        if header.get_header("Proxy-Connection"):
-            header.set_header("Proxy-Connection", "close")
+        raw_header, packet_buf = result
+        # The header goes back to the parser's pool once the request is done
+        with http_parser.HTTPHeader.scoped(raw_header) as header:
+            header.set_header("Connection", "close")
+            header.set_version("HTTP/1.0")
+            if header.get_header("Proxy-Connection"):
+                header.set_header("Proxy-Connection", "close")
 
-        # Print output to console
-        print(header.to_output())
-        
-        # Create TCP socket to destination server
-        dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        with sockets_lock:
-            sockets.append(dest_socket)
-
-        # Forward the request to the handler for the request type
-        if header.get_method() == "CONNECT":
-            process_connection_request(client_socket, dest_socket, header)
-        else:
-            process_non_connection_request(client_socket, dest_socket, header, packet_buf)
+            # Print output to console
+            trace(header.to_output())
+
+            # Forward the request to the handler for the request type
+            if header.get_method() == "CONNECT":
+                # Create TCP socket to destination server
+                dest_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                dest_socket.setblocking(False)
+                tune_socket(dest_socket)
+                await process_connection_request(client_socket, dest_socket, header)
+            else:
+                await process_non_connection_request(client_socket, header, packet_buf)
 
         return
     except KeyboardInterrupt:
-        if DEBUG:
-            print("\nKeyboard interrupt received. Stopping worker...")
+        log.debug("Keyboard interrupt received. Stopping worker...")
         return
+    finally:
+        # This task is the only owner of both sockets
+        client_socket.close()
+        if dest_socket is not None:
+            dest_socket.close()
 
-def process_connection_request(client_socket, dest_socket, header):
+async def process_connection_request(client_socket: socket.socket, dest_socket: socket.socket,
+                                     header: http_parser.HTTPHeader) -> None:
     '''
     Processes a connection request by creating TCP connections with
     client_socket and with dest_socket, and relays information between
     the two.
     '''
-    dest = header.get_header("Host") or header.get_header("host")
-    if DEBUG:
-        print(header.generate_header())
+    loop = asyncio.get_running_loop()
+    dest = header.get_header("Host")
+    log.debug("%s", header)
 
     try:
         # Parse host and port (default to 80 if not specified)
         host, port = get_host_port(header)
 
-        if DEBUG:
-            print(f"Connecting to {host}:{port}")
+        log.debug("Connecting to %s:%s", host, port)
 
         # We just need to connect to dest and reply ok to client
         try:
-            dest_socket.connect((host, port))
-            dest_socket.settimeout(5)
+            await loop.sock_connect(dest_socket, await resolve(host, port))
+            quick_ack(dest_socket)
         except Exception as e:
             # If we cannot connect, shut down
-            if DEBUG:
-                print(f"Could not connect: {e}")
+            log.debug("Could not connect: %s", e)
 
-            error_response = "HTTP/1.0 502 Bad Gateway\r\n\r\n"
-            client_socket.send(error_response.encode())
-        
-            cleanup_socket(dest_socket)
-            cleanup_socket(client_socket)
+            await loop.sock_sendall(client_socket, BAD_GATEWAY)
             return
 
-        ok_response = "HTTP/1.0 200 Connection Established\r\n\r\n"
-        client_socket.send(ok_response.encode())
+        await loop.sock_sendall(client_socket, CONNECTION_ESTABLISHED)
 
-        # Now just forward data between client and dest
-        while True:
-            has_data, _, _ = select.select([client_socket, dest_socket], [], [], .0001)
-            if client_socket in has_data:
-                data = client_socket.recv(BUF_SIZE)
-                if data == b"":
-                    client_socket.close()
-                    dest_socket.close()
-                    break
-                dest_socket.send(data)
-            if dest_socket in has_data:
-                data = dest_socket.recv(BUF_SIZE)
-                if data == b"":
-                    client_socket.close()
-                    dest_socket.close()
-                    break
-                client_socket.send(data)
+        # Now just forward data between client and dest, one task per
+        # direction. A close on one side only ends its own direction, so
+        # the other keeps draining until both are done or one fails
+        pipes = [loop.create_task(pipe(client_socket, dest_socket)),
+                 loop.create_task(pipe(dest_socket, client_socket))]
+        try:
+            await asyncio.wait(pipes, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in pipes:
+                task.cancel()
+            await asyncio.gather(*pipes, return_exceptions=True)
 
-        if DEBUG:
-            print("finished sending to client")
+        log.debug("finished sending to client")
 
         
     except Exception as e:
-        if DEBUG:
-            print(f"Error connecting to {dest}: {e}")
-    finally:
-        cleanup_socket(dest_socket)
-        cleanup_socket(client_socket)
+        log.debug("Error connecting to %s: %s", dest, e)
     return
 
-def process_non_connection_request(client_socket, dest_socket, header, packet_buf):
+async def process_non_connection_request(client_socket: socket.socket, header: http_parser.HTTPHeader,
+                                         packet_buf: bytes) -> None:
     '''
     Handles a non-connection request. This method sends the request from the client to
-    dest_socket, and relays information back to client_socket.
+    its destination, and relays the response back to client_socket. With
+    --keep-alive the upstream connection is taken from and returned to
+    the pool when the exchange leaves it in a clean state.
     '''
-    dest = header.get_header("Host") or header.get_header("host")
-    if DEBUG:
-        print(header.generate_header())
+    loop = asyncio.get_running_loop()
+    dest = header.get_header("Host")
+    log.debug("%s", header)
 
+    dest_socket = None
+    reusable = False
     try:
         # Parse host and port (default to 80 if not specified)
         host, port = get_host_port(header)
-        if DEBUG:
-            print(f"Connecting to {host}:{port}")
+
+        # Without chunked as the final coding there is no way to tell where
+        # the body ends (RFC 9112 6.3), and falling back on Content-Length
+        # would let the proxy and the origin disagree about it
+        if header.get_header("Transfer-Encoding") is not None and not is_chunked(header):
+            log.debug("rejecting request with unframed transfer coding")
+            await loop.sock_sendall(client_socket, BAD_REQUEST)
+            return
+
+        log.debug("Connecting to %s:%s", host, port)
         
-        dest_socket.connect((host, port))
-        dest_socket.settimeout(5)
-        client_socket.settimeout(5)
+        dest_socket = await open_upstream(host, port)
         
         header.change_path_to_relative()
-        header.set_header("Connection", "close")
+        header.set_header("Connection", "keep-alive" if KEEP_ALIVE else "close")
         header.set_version("HTTP/1.0")
         header.set_header("Proxy-Connection", "close")
+        # RFC 9112 6.3: a forwarded message must not carry both framings
+        if header.get_header("Transfer-Encoding") is not None:
+            header.remove_header("Content-Length")
 
         #send what we have so far, continue sending rest of packet if any
-        dest_socket.send(header.generate_header().encode() + packet_buf)
-        if DEBUG:
-            print(f"sending header to dest {repr(header.generate_header().encode())}, packet_buf length {len(packet_buf)}")
-        if header.get_header("Content-Length") or header.get_header("Transfer-Encoding"):
-            client_payload = b""
-            while client_payload.find(b"\r\n\r\n") == -1:
-                if DEBUG:
-                    print("getting payload from client")
-                try:
-                    data = client_socket.recv(BUF_SIZE)
-                except socket.timeout:
-                    break
-                if not data:
-                    break
+        log.debug("sending header to dest %s, packet_buf length %d", header, len(packet_buf))
+        await send_buffers(dest_socket, header.iovecs() + [packet_buf])
 
-                if DEBUG:
-                    print(f"received data of length {len(data)}")
-                dest_socket.send(data)
+        # Forward the rest of the request body, framed the way the client
+        # framed it; chunked encoding takes precedence over a length. Bytes
+        # past the end of the body (a pipelined request) went upstream too,
+        # so the connection is out of step and must not be reused
+        request_done = not packet_buf
+        if is_chunked(header):
+            log.debug("getting chunked payload from client")
+            request_done = await forward_chunked(client_socket, dest_socket, packet_buf)
+        elif header.get_header("Content-Length"):
+            log.debug("getting payload from client")
+            left = int(header.get_header("Content-Length")) - len(packet_buf)
+            request_done = await forward_known_length(client_socket, dest_socket, left)
         
         # Now receive response from destination and send back to client
-        resp_buf = b""
-        while resp_buf.find(b"\r\n\r\n") == -1:
-            if DEBUG:
-                print("getting header from dest")
-            try:
-                response = dest_socket.recv(BUF_SIZE)
-            except socket.timeout:
-                if DEBUG:
-                    print("timeout")
-                break
-            if not response:
-                if DEBUG:
-                    print("no response")
-                break
+        log.debug("getting header from dest")
+        # Re-arm before the response arrives; on a reused connection the
+        # kernel has long since fallen back to delayed ACKs, which stalls
+        # an origin that writes the header and body separately
+        quick_ack(dest_socket)
+        result = await read_header(dest_socket)
+        if result is None:
+            log.debug("no response")
+            return
+        raw_header, resp_buf = result
+        # The header is only needed until its framing is known; it goes
+        # back to the parser's pool before the body is relayed
+        with http_parser.HTTPHeader.scoped(raw_header) as resp_header:
+            keep_alive = KEEP_ALIVE and upstream_keeps_alive(resp_header)
+            resp_header.set_version("HTTP/1.0")
+            resp_header.set_header("Connection", "close")
+            resp_header.set_header("Proxy-Connection", "close")
 
-            if DEBUG:
-                print(f"received data of length {len(response)}")
-            resp_buf += response
-        
-        # process server response header
-        raw_header = resp_buf.split(b"\r\n\r\n")[0]
-        resp_buf = resp_buf.split(b"\r\n\r\n",1)[1]
-        resp_header = http_parser.HTTPHeader(raw_header.decode())
-        resp_header.set_version("HTTP/1.0")
-        resp_header.set_header("Connection", "close")
-        resp_header.set_header("Proxy-Connection", "close")
-
-        if DEBUG:
-            print(f"sending header to client {resp_header.generate_header()}")
-
-        # send header + initial recieved payload to client
-        client_socket.send(resp_header.generate_header().encode())
-        client_socket.send(resp_buf)
-
-        # continue sending rest of payload if any
-        content_length = resp_header.get_header("Content-Length")
-
-        if DEBUG:
-            print(f"sending payload to client {len(resp_buf)} bytes out of {content_length if content_length else 'unknown'}")
-        if content_length and len(resp_buf) < int(content_length) or resp_header.get_header("Transfer-Encoding"):
-            while True:
-                if DEBUG:
-                    print("getting payload from dest")
-                try:
-                    response = dest_socket.recv(BUF_SIZE)
-                except socket.timeout:
-                    break
-                if not response:
-                    break
+            # Work out the framing before the header goes out, by the same
+            # rules as the request; with neither a length nor chunking the
+            # body runs until dest closes. Any Transfer-Encoding overrides
+            # Content-Length, so one that does not end in chunked also does,
+            # and the length is dropped rather than forwarded (RFC 9112 6.3)
+            has_body = response_has_body(header.get_method(), resp_header)
+            # A 1xx response is followed by another one (or, for 101, by a
+            # different protocol), so the connection is never reusable
+            final = (resp_header.get_status_code() or 0) >= 200
+            chunked = is_chunked(resp_header)
+            content_length = resp_header.get_header("Content-Length")
+            if resp_header.get_header("Transfer-Encoding") is not None:
+                content_length = None
+                resp_header.remove_header("Content-Length")
+
+            log.debug("sending header to client %s", resp_header)
 
-                if DEBUG:
-                    print(f"received data of length {len(response)}")
-                client_socket.send(response)
+            # send header + initial recieved payload to client
+            await send_buffers(client_socket, resp_header.iovecs() + [resp_buf])
 
-        if DEBUG:
-            print("finished sending to client")
+        log.debug("sending payload to client %d bytes out of %s", len(resp_buf), content_length or "unknown")
+        if not has_body:
+            response_done = final and not resp_buf
+        elif chunked:
+            log.debug("getting chunked payload from dest")
+            response_done = await forward_chunked(dest_socket, client_socket, resp_buf)
+        elif content_length is not None:
+            log.debug("getting payload from dest")
+            left = int(content_length) - len(resp_buf)
+            response_done = await forward_known_length(dest_socket, client_socket, left)
+        else:
+            log.debug("getting payload from dest until close")
+            await splice_body(dest_socket, client_socket)
+            response_done = False
+
+        # The connection can only carry another request if both bodies were
+        # framed and forwarded exactly
+        reusable = keep_alive and response_done and request_done
+
+        log.debug("finished sending to client")
     except Exception as e:
-        if DEBUG:
-            print(f"Error connecting to {dest}: {e}")
+        log.debug("Error connecting to %s: %s", dest, e)
     finally:
-        cleanup_socket(dest_socket)
-        cleanup_socket(client_socket)
+        if dest_socket is not None:
+            if reusable:
+                release_upstream(host, port, dest_socket)
+            else:
+                dest_socket.close()
 
     return
 
@@ -345,7 +1034,7 @@ def get_host_port(header: http_parser.HTTPHeader) -> Tuple[str, int]:
     '''
     Returns the host and port from a given HTTP request header
     '''
-    dest = header.get_header("Host") or header.get_header("host")
+    dest = header.get_header("Host")
     if ':' in dest:
         host, port = dest.split(':')
         port = int(port)
@@ -358,12 +1047,6 @@ def get_host_port(header: http_parser.HTTPHeader) -> Tuple[str, int]:
             port = 443
     return host, port
 
-def usage(name):
-    '''
-    Prints out proper usage for the program
-    '''
-    print(f"Usage: {name} port")
-
 if __name__ == "__main__":
     args = sys.argv
     main(args)
@@ -0,0 +1,403 @@
+"""
+Unit tests for server.py socket helpers, message framing and the
+upstream connection pool.
+
+Tests drive the helpers and handlers over local sockets.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+import unittest
+
+import http_parser
+import server
+
+
+def read_all(sock):
+    """Read from a blocking socket until the peer closes it."""
+    data = b""
+    chunk = sock.recv(65536)
+    while chunk:
+        data += chunk
+        chunk = sock.recv(65536)
+    return data
+
+
+def relay(request, packet_buf=b""):
+    """Run one request through the proxy and return what the client got."""
+    client, proxy = socket.socketpair()
+    with client, proxy:
+        proxy.setblocking(False)
+        header = http_parser.HTTPHeader(request)
+        asyncio.run(server.process_non_connection_request(proxy, header, packet_buf))
+        proxy.shutdown(socket.SHUT_WR)
+        return read_all(client)
+
+
+class EchoOrigin:
+    """
+    Keep-alive origin on a local port that answers each request with
+    "echo:<path>", waiting a moment first for paths containing "slow".
+    """
+
+    def __init__(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.connections = 0
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        data = b""
+        with conn:
+            while True:
+                end = data.find(b"\r\n\r\n")
+                if end < 0:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        return
+                    data += chunk
+                    continue
+                header = http_parser.HTTPHeader(data[:end])
+                data = data[end + 4:]
+                if header.get_header("Transfer-Encoding"):
+                    while b"0\r\n\r\n" not in data:
+                        data += conn.recv(65536)
+                    data = data[data.index(b"0\r\n\r\n") + 5:]
+                else:
+                    length = int(header.get_header("Content-Length") or 0)
+                    while len(data) < length:
+                        data += conn.recv(65536)
+                    data = data[length:]
+                body = b"echo:" + header.get_path().encode()
+                if b"slow" in body:
+                    time.sleep(0.2)
+                reply = b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body)
+                conn.sendall(reply if header.get_method() == "HEAD" else reply + body)
+
+
+class TestKeepAlive(unittest.TestCase):
+    """Test which exchanges leave an upstream connection fit for reuse."""
+
+    def setUp(self):
+        self.keep_alive = server.KEEP_ALIVE
+        server.KEEP_ALIVE = True
+        self.origin = EchoOrigin()
+        self.host = f"127.0.0.1:{self.origin.port}"
+
+    def tearDown(self):
+        server.KEEP_ALIVE = self.keep_alive
+        for idle in server.upstream_pool.values():
+            for _, sock in idle:
+                sock.close()
+        server.upstream_pool.clear()
+        self.origin.close()
+
+    def get(self, path, packet_buf=b"", method="GET"):
+        return relay(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n", packet_buf)
+
+    def assertReused(self, reused):
+        """Check whether the last exchange left its connection in the pool."""
+        self.assertEqual(bool(server.upstream_pool.get(("127.0.0.1", self.origin.port))), reused)
+
+    def test_bodiless_request_is_reused(self):
+        """Test that a plain GET leaves its connection for the next request."""
+        self.get("/a")
+        self.assertReused(True)
+
+        self.assertTrue(self.get("/b").endswith(b"echo:/b"))
+        self.assertEqual(self.origin.connections, 1)
+
+    def test_head_request_is_reused(self):
+        """Test that a HEAD response is not waited on for its Content-Length."""
+        reply = self.get("/a", method="HEAD")
+
+        self.assertIn(b"\r\nContent-Length: 7\r\n", reply)
+        self.assertTrue(reply.endswith(b"\r\n\r\n"))
+        self.assertReused(True)
+
+    def test_chunked_request_is_reused(self):
+        """Test that a chunked request body framed exactly is reusable."""
+        relay(f"POST /a HTTP/1.1\r\nHost: {self.host}\r\n"
+              "Transfer-Encoding: chunked\r\n\r\n", b"3\r\nabc\r\n0\r\n\r\n")
+        self.assertReused(True)
+
+    def test_leftover_bytes_are_not_reused(self):
+        """Test that bytes past a request body keep the connection out of the pool."""
+        for request, packet_buf in (
+                ("GET /a HTTP/1.1\r\nHost: {}\r\n\r\n", b"x"),
+                ("POST /a HTTP/1.1\r\nHost: {}\r\nContent-Length: 3\r\n\r\n", b"abcx"),
+                ("POST /a HTTP/1.1\r\nHost: {}\r\nTransfer-Encoding: chunked\r\n\r\n",
+                 b"3\r\nabc\r\n0\r\n\r\nx")):
+            with self.subTest(request=request, packet_buf=packet_buf):
+                relay(request.format(self.host), packet_buf)
+                self.assertReused(False)
+
+    def test_pipelined_request_is_not_reused(self):
+        """Test that a response to bytes past the request never reaches another client."""
+        pipelined = f"GET /slow-secret HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode()
+
+        self.assertTrue(self.get("/a", pipelined).endswith(b"\r\n\r\necho:/a"))
+        self.assertFalse(server.upstream_pool)
+        self.assertTrue(self.get("/b").endswith(b"\r\n\r\necho:/b"))
+
+
+class TestSocketHelpers(unittest.TestCase):
+    """Test the helpers that read headers and gather writes."""
+
+    def test_send_buffers_resumes_partial_writes(self):
+        """Test that buffers larger than the send buffer arrive whole and in order."""
+        buffers = [b"a" * 300000, b"b" * 5, b"", b"c" * 200000]
+        left, right = socket.socketpair()
+        with left, right:
+            left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            left.setblocking(False)
+            received = []
+            reader = threading.Thread(target=lambda: received.append(read_all(right)))
+            reader.start()
+            asyncio.run(server.send_buffers(left, buffers))
+            left.shutdown(socket.SHUT_WR)
+            reader.join()
+
+        self.assertEqual(received[0], b"".join(buffers))
+
+    def read_header(self, pieces):
+        """Run read_header over pieces that arrive one read at a time."""
+        async def run():
+            sock, feed = socket.socketpair()
+            with sock, feed:
+                sock.setblocking(False)
+                task = asyncio.ensure_future(server.read_header(sock))
+                for piece in pieces:
+                    feed.sendall(piece)
+                    await asyncio.sleep(0.005)
+                return await asyncio.wait_for(task, 1)
+        return asyncio.run(run())
+
+    def test_read_header_split_terminator(self):
+        """Test a blank line that straddles two reads, in each line-ending form."""
+        for first, second in ((b"Host: a\r\n\r", b"\nbody"),
+                              (b"Host: a\r\n", b"\r\nbody"),
+                              (b"Host: a\n", b"\nbody"),
+                              (b"Host: a\n", b"\r\nbody")):
+            with self.subTest(first=first, second=second):
+                header, leftover = self.read_header([b"GET / HTTP/1.1\r\n" + first, second])
+
+                self.assertEqual(header, b"GET / HTTP/1.1\r\nHost: a")
+                self.assertEqual(leftover, b"body")
+
+    def test_read_header_rejects_oversized_header(self):
+        """Test that a header with no end in sight is refused."""
+        with self.assertRaises(ValueError):
+            self.read_header([b"GET / HTTP/1.1\r\nX: " + b"a" * server.MAX_HEADER_SIZE])
+
+
+class TestUpstreamPool(unittest.TestCase):
+    """Test how idle upstream connections are kept and evicted."""
+
+    def setUp(self):
+        self.limits = server.POOL_SIZE, server.POOL_TOTAL_SIZE
+        self.sockets = []
+
+    def tearDown(self):
+        server.POOL_SIZE, server.POOL_TOTAL_SIZE = self.limits
+        server.upstream_pool.clear()
+        for sock in self.sockets:
+            sock.close()
+
+    def park(self, host, idle_since=None):
+        """Release a fresh connection to host, optionally backdating it."""
+        sock, peer = socket.socketpair()
+        self.sockets += (sock, peer)
+        server.release_upstream(host, 80, sock)
+        if idle_since is not None:
+            entries = server.upstream_pool[(host, 80)]
+            entries[-1] = (idle_since, entries[-1][1])
+        return sock
+
+    def test_expired_connections_are_swept_across_origins(self):
+        """Test that parking anywhere closes connections idled out elsewhere."""
+        stale = self.park("a", time.monotonic() - server.POOL_IDLE_TIMEOUT)
+
+        self.park("b")
+
+        self.assertEqual(list(server.upstream_pool), [("b", 80)])
+        self.assertEqual(stale.fileno(), -1)
+
+    def test_total_cap_evicts_longest_idle(self):
+        """Test that a full pool closes the connection idle the longest."""
+        server.POOL_TOTAL_SIZE = 2
+        oldest = self.park("a", time.monotonic() - 10)
+        self.park("b")
+
+        self.park("c")
+
+        self.assertEqual(sorted(server.upstream_pool), [("b", 80), ("c", 80)])
+        self.assertEqual(oldest.fileno(), -1)
+
+    def test_per_origin_cap(self):
+        """Test that an origin never holds more than POOL_SIZE idle connections."""
+        server.POOL_SIZE = 1
+        self.park("a")
+
+        extra = self.park("a")
+
+        self.assertEqual(len(server.upstream_pool[("a", 80)]), 1)
+        self.assertEqual(extra.fileno(), -1)
+
+
+class TestTransferEncodingFraming(unittest.TestCase):
+    """Test that Transfer-Encoding always overrides Content-Length."""
+
+    def test_request_with_unchunked_coding_is_rejected(self):
+        """Test that a request whose last coding is not chunked gets a 400."""
+        for coding in ("gzip", "chunked, gzip", "identity"):
+            with self.subTest(coding=coding):
+                reply = relay("POST / HTTP/1.1\r\nHost: 127.0.0.1:9\r\n"
+                                   f"Transfer-Encoding: {coding}\r\n"
+                                   "Content-Length: 5\r\n\r\n")
+
+                self.assertEqual(reply, server.BAD_REQUEST)
+
+    def exchange(self, request, packet_buf, response):
+        """Relay one request to a one-shot origin; return what it and the client got."""
+        listener = socket.create_server(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        received = []
+
+        def origin():
+            conn, _ = listener.accept()
+            with conn:
+                # Read the header, and a chunked body through its last chunk
+                data = b""
+                while (b"\r\n\r\n" not in data
+                       or b"chunked" in data and not data.endswith(b"0\r\n\r\n")):
+                    data += conn.recv(65536)
+                received.append(data)
+                conn.sendall(response)
+
+        thread = threading.Thread(target=origin)
+        thread.start()
+        try:
+            reply = relay(request.format(port=port), packet_buf)
+        finally:
+            thread.join()
+            listener.close()
+        return received[0], reply
+
+    def test_request_with_chunked_coding_drops_content_length(self):
+        """Test that Content-Length is not forwarded next to chunked coding."""
+        body = b"3\r\nabc\r\n0\r\n\r\n"
+        forwarded, reply = self.exchange(
+            "POST / HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+            "Transfer-Encoding: chunked\r\nContent-Length: 100\r\n\r\n",
+            body, b"HTTP/1.1 204 No Content\r\n\r\n")
+
+        self.assertNotIn(b"content-length", forwarded.lower())
+        self.assertTrue(forwarded.endswith(b"\r\n\r\n" + body))
+        self.assertTrue(reply.startswith(b"HTTP/1.0 204 No Content\r\n"))
+
+    def test_response_with_unchunked_coding_reads_to_close(self):
+        """Test that a response body is read to close despite Content-Length."""
+        _, reply = self.exchange(
+            "GET / HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n", b"",
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: gzip\r\n"
+            b"Content-Length: 3\r\n\r\nabcdef")
+
+        self.assertTrue(reply.startswith(b"HTTP/1.0 200 OK\r\n"))
+        self.assertTrue(reply.endswith(b"\r\n\r\nabcdef"))
+        self.assertNotIn(b"content-length", reply.lower())
+
+class TestForwardChunked(unittest.TestCase):
+    """Test relaying chunked bodies that arrive in pieces."""
+
+    BODY = (b"4;ext=1\r\nWiki\r\n5\r\npedia\r\n"
+            b"E; name=\"v\"\r\n in\r\n\r\nchunks.\r\n"
+            b"0\r\nExpires: never\r\nX-Trailer: 1\r\n\r\n")
+
+    def forward(self, data, pieces):
+        """Feed pieces to forward_chunked one read at a time and collect its output."""
+        async def run():
+            src, feed = socket.socketpair()
+            dst, sink = socket.socketpair()
+            with src, feed, dst, sink:
+                src.setblocking(False)
+                dst.setblocking(False)
+                task = asyncio.ensure_future(server.forward_chunked(src, dst, data))
+                for piece in pieces:
+                    feed.sendall(piece)
+                    await asyncio.sleep(0.005)
+                # The body ends without src closing, so the result is in
+                # before feed is ever shut down
+                done = await asyncio.wait_for(task, 1)
+                dst.shutdown(socket.SHUT_WR)
+                return done, read_all(sink)
+        return asyncio.run(run())
+
+    def test_forward_in_pieces(self):
+        """Test chunk sizes, data and CRLFs split across separate reads."""
+        # Cut inside a size line's CRLF, inside the CRLF after chunk data,
+        # inside chunk data that itself holds CRLFs and inside the trailers
+        cuts = [3, 15, 17, 24, 40, 46, 60, 75, len(self.BODY)]
+        pieces = [self.BODY[i:j] for i, j in zip(cuts, cuts[1:])]
+
+        done, relayed = self.forward(self.BODY[:3], pieces)
+
+        self.assertTrue(done)
+        self.assertEqual(relayed, self.BODY[3:])
+
+    def test_forward_one_byte_at_a_time(self):
+        """Test a body that arrives a single byte per read."""
+        pieces = [self.BODY[i:i + 1] for i in range(len(self.BODY))]
+
+        done, relayed = self.forward(b"", pieces)
+
+        self.assertTrue(done)
+        self.assertEqual(relayed, self.BODY)
+
+    def test_forward_reports_bytes_past_the_end(self):
+        """Test that bytes after the trailers are relayed but reported."""
+        done, relayed = self.forward(b"", [self.BODY + b"GET / HTTP/1.1\r\n"])
+
+        self.assertFalse(done)
+        self.assertEqual(relayed, self.BODY + b"GET / HTTP/1.1\r\n")
+
+    def test_forward_rejects_malformed_sizes(self):
+        """Test that chunk sizes int() would accept but HTTP does not are refused."""
+        for size in (b"0x5", b"1_0", b"+5", b" 5 ", b"-5", b"5 ", b"", b"g"):
+            with self.subTest(size=size):
+                with self.assertRaises(ValueError):
+                    self.forward(b"", [size + b"\r\nhello\r\n0\r\n\r\n"])
+
+        done, relayed = self.forward(b"", [b"5 ;ext\r\nhello\r\n0\r\n\r\n"])
+        self.assertTrue(done)
+
+    def test_forward_reports_early_close(self):
+        """Test that src closing inside chunk data is reported."""
+        async def run():
+            src, feed = socket.socketpair()
+            dst, sink = socket.socketpair()
+            with src, dst, sink:
+                src.setblocking(False)
+                dst.setblocking(False)
+                with feed:
+                    feed.sendall(self.BODY[:12])
+                return await server.forward_chunked(src, dst, b"")
+
+        self.assertFalse(asyncio.run(run()))
+
+if __name__ == '__main__':
+    unittest.main()